@@ -1,27 +1,54 @@
 import glob
 import os
+import subprocess
+import sys
 
 
-def setup():
+PACKAGE_FILES = ("setup.py", "setup.cfg", "pyproject.toml")
+
+
+def code_folders():
     """
-    run pip install for all libs in the model code folder
+    all installable libs in the model code folder, plain module folders are
+    loaded from code/ by mlflow and are skipped
     """
-    cwd = os.getcwd()
+    return [
+        folder for folder in glob.glob("code/*")
+        if os.path.isdir(folder)
+        and any(os.path.isfile(os.path.join(folder, f)) for f in PACKAGE_FILES)
+    ]
 
-    for folder in glob.glob("code/*"):
-        # loop all folders
-        if os.path.isdir(folder):
 
+def build_wheels(wheel_dir):
+    """
+    build wheels for all libs in the model code folder, their dependencies
+    are resolved when the wheels are installed
+    """
+    for folder in code_folders():
+        subprocess.run(
+            ["pip", "wheel", "--no-cache-dir", "--no-deps", "-w", os.path.abspath(wheel_dir), "."],
+            cwd=folder, check=True,
+        )
 
-            os.chdir(folder)
-            # run pip install
-            os.system(
-                f'pip install .' 
-            )  
-            os.chdir(cwd)
 
-    os.chdir(cwd)
+def setup(wheel_dir=None):
+    """
+    run pip install for all libs in the model code folder, or for their
+    prebuilt wheels if a wheel dir is given
+    """
+    if wheel_dir is not None:
+        wheels = glob.glob(os.path.join(wheel_dir, "*.whl"))
+        if wheels:
+            subprocess.run(["pip", "install", "--no-cache-dir", *wheels], check=True)
+        return
+
+    for folder in code_folders():
+        # run pip install
+        subprocess.run(["pip", "install", "--no-cache-dir", "."], cwd=folder, check=True)
 
 
 if __name__ == "__main__":
-    setup()
+    if len(sys.argv) == 3 and sys.argv[1] == "wheel":
+        build_wheels(sys.argv[2])
+    else:
+        setup(sys.argv[1] if len(sys.argv) > 1 else None)
@@ -2,128 +2,370 @@ from fastapi import FastAPI
 from fastapi.responses import RedirectResponse
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
-from typing import List, Dict
+from typing import Any, List, Dict
 
 
 
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import glob
+import hashlib
 import os
+import threading
+import time
+import uuid
 import shutil
+from string import Template
+import subprocess
 import mlflow
+from mlflow.artifacts import download_artifacts
 from mlflow.tracking import MlflowClient
 import docker
 import configparser
+import yaml
+from types import SimpleNamespace
 
-import requests
+import httpx
 
 # load config once
 config = configparser.ConfigParser()
 config.read('/default.cfg')
+
+DATABRICKS = SimpleNamespace(
+    token=config.get('Databricks', 'TOKEN'),
+    registry=config.get('Databricks', 'REGISTRY'),
+    user=config.get('Databricks', 'USER'),
+)
+DOCKER = SimpleNamespace(
+    host=config.get('Docker', 'HOST'),
+    token=config.get('Docker', 'TOKEN'),
+    user=config.get('Docker', 'USER'),
+    org=config.get('Docker', 'ORG'),
+)
+# list of marked tags
+MODEL_TAGS = tuple(
+    e.strip() for e in config.get("Models", "TAGS", fallback="").split(",") if e.strip() != ''
+)
+BUILD_WORKERS = config.getint("Build", "WORKERS", fallback=4)
+# long running docker builds get their own bounded pool, the short registry
+# lookups stay on the default executor and are not starved by the builds
+BUILD_EXECUTOR = ThreadPoolExecutor(max_workers=BUILD_WORKERS)
+# prune docker only when the free disk space drops below the ratio
+PRUNE_PATH = config.get("Build", "PRUNE_PATH", fallback="/")
+PRUNE_FREE_RATIO = config.getfloat("Build", "PRUNE_FREE_RATIO", fallback=0.1)
+
 BASE_IMAGE_NAME = "mlflow-packer-base"
+BASE_IMAGE_CACHE_TAG = "cache"
+BUILDX_BUILDER = "mlflow-packer"
+# salt of the requirements hash, change it to invalidate all base images
+BASE_IMAGE_SALT = b"15.10.2026-3"
 
+# prefer the libyaml parser if pyyaml was built with it
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
 
-def get_mflow_client():
-    token = config.get('Databricks', 'TOKEN')
-    registry = config.get('Databricks', 'REGISTRY')
-    user = config.get('Databricks', 'USER')
+# base image with all the requirements of a model, change BASE_IMAGE_SALT
+# when editing it to rebuild the existing base images
+BASE_DOCKERFILE = Template("""# syntax=docker/dockerfile:1.4
+FROM python:$python_version AS builder
+
+# the venv gets the bundled ensurepip pip, upgrade it to find current wheels
+RUN python -m venv /opt/venv \\
+    && /opt/venv/bin/pip install --no-cache-dir --upgrade pip
+ENV PATH=/opt/venv/bin:$$PATH
+
+COPY $model_dir/requirements.txt /tmp/
+RUN --mount=type=cache,target=/root/.cache/pip \\
+    pip install -r /tmp/requirements.txt \\
+    && pip install uvicorn==0.18.2 protobuf==3.20.* fastapi==0.80.*
+
+# slim runtime without compiler, only the common runtime libraries are added:
+# libgomp1 for lightgbm / xgboost, anything else must come with the wheels
+FROM python:$python_version-slim
+
+RUN apt-get update \\
+    && apt-get install -y --no-install-recommends libgomp1 \\
+    && rm -rf /var/lib/apt/lists/*
+
+COPY --from=builder /opt/venv /opt/venv
+ENV PATH=/opt/venv/bin:$$PATH
+RUN mkdir -p /model
+
+WORKDIR /model
+EXPOSE 8080
+
+ENTRYPOINT gunicorn main:app --workers 2 --worker-class uvicorn.workers.UvicornWorker --bind 0.0.0.0:8080 --timeout 120
+""")
+
+# model image with the serving code on top of the base image
+MODEL_DOCKERFILE = Template("""
+FROM $base_image
+
+COPY $model_dir/ /model/
+""")
+
+# model image for models with installable libs in code/, they are built to
+# wheels in a full python image as the base image has no compiler
+MODEL_WHEELS_DOCKERFILE = Template("""# syntax=docker/dockerfile:1.4
+FROM python:$python_version AS builder
+
+COPY $model_dir/code /model/code
+COPY $model_dir/setup.py /model/
+WORKDIR /model
+RUN mkdir -p /wheels && python setup.py wheel /wheels
+
+FROM $base_image
+
+COPY $model_dir/ /model/
+RUN --mount=type=bind,from=builder,source=/wheels,target=/wheels \\
+    python setup.py /wheels
+""")
+
+# files marking a code/ folder as an installable lib, see buildtemplate/setup.py
+PACKAGE_FILES = ("setup.py", "setup.cfg", "pyproject.toml")
+
+# keep the connections to the docker hub api open between requests
+HUB_CLIENT = httpx.AsyncClient(
+    http2=True, timeout=10, limits=httpx.Limits(max_connections=64)
+)
+
+# docker hub jwt, refreshed after the ttl or when the hub answers with 401
+HUB_JWT_TTL = 300
+_hub_jwt = {"token": None, "expires": 0.0}
+# serializes the hub logins, created on first use as asyncio.Lock binds to
+# the current event loop on python < 3.10
+_hub_jwt_lock = None
+
+# in process build jobs by task id, and the running ones by (name, version, env),
+# finished jobs can be polled for BUILD_JOB_TTL seconds
+BUILD_JOB_TTL = 3600
+_build_jobs = {}
+_inflight_builds = {}
+
+# fan out the per model tag requests, bounded to stay below the hub rate limits
+HUB_CONCURRENCY = 16
+
+# registered models are cached shortly, the registry listing is slow
+REGISTRY_CACHE_TTL = 30
+_registry_cache = {}
+_registry_cache_lock = threading.Lock()
 
-    os.environ['DATABRICKS_HOST'] = registry
-    os.environ['DATABRICKS_TOKEN'] = token
-    os.environ["MLFLOW_TRACKING_TOKEN"] = token
+
+@lru_cache(maxsize=1)
+def get_mflow_client():
+    """
+    mlflow client shared by all requests, the environment is set up once
+    """
+    os.environ['DATABRICKS_HOST'] = DATABRICKS.registry
+    os.environ['DATABRICKS_TOKEN'] = DATABRICKS.token
+    os.environ["MLFLOW_TRACKING_TOKEN"] = DATABRICKS.token
     os.environ["MLFLOW_TRACKING_INSECURE_TLS"] = "true"
-    mlflow.set_tracking_uri(registry)
+    mlflow.set_tracking_uri(DATABRICKS.registry)
 
     return MlflowClient()
 
 
-def get_repo_tags(repo):
+def list_marked_models(model_tags=MODEL_TAGS):
+    """
+    registered models with one of the marked tags, cached for REGISTRY_CACHE_TTL
+    """
+    with _registry_cache_lock:
+        cached = _registry_cache.get(model_tags)
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
+
+    tag_set = frozenset(model_tags)
+    models = [
+        m for m in get_mflow_client().list_registered_models()
+        if not tag_set or not tag_set.isdisjoint(m.tags)
+    ]
 
-    repo = repo.replace("_", "-")
-    
-    base_url = config.get('Docker', 'HOST')
-    token = config.get('Docker', 'TOKEN')
-    user = config.get('Docker', 'USER')
-    org = config.get('Docker', 'ORG')
+    with _registry_cache_lock:
+        _registry_cache[model_tags] = (time.monotonic() + REGISTRY_CACHE_TTL, models)
+
+    return models
 
-    login_url = f"{base_url}/users/login"
-    repo_url = f"{base_url}/repositories/{org}/{repo}/tags"
 
-    tok_req = requests.post(
-        login_url, json={"username": user, "password": token})
-    token = tok_req.json()["token"]
-    headers = {"Authorization": f"JWT {token}"}
+def clear_registry_cache():
+    with _registry_cache_lock:
+        _registry_cache.clear()
 
-    res = requests.get(repo_url, headers=headers)
+
+async def get_hub_jwt(stale=None):
+    """
+    login to the docker hub api, the token is reused until it expires or the
+    hub rejects it, pass the rejected token as stale to refresh it once
+    """
+    global _hub_jwt_lock
+    if _hub_jwt_lock is None:
+        _hub_jwt_lock = asyncio.Lock()
+
+    async with _hub_jwt_lock:
+        if (_hub_jwt["token"] is None or _hub_jwt["token"] == stale
+                or _hub_jwt["expires"] < time.monotonic()):
+            tok_req = await HUB_CLIENT.post(
+                f"{DOCKER.host}/users/login",
+                json={"username": DOCKER.user, "password": DOCKER.token})
+            tok_req.raise_for_status()
+            _hub_jwt["token"] = tok_req.json()["token"]
+            _hub_jwt["expires"] = time.monotonic() + HUB_JWT_TTL
+
+        return _hub_jwt["token"]
+
+
+async def get_repo_tags(repo):
+
+    repo = repo.replace("_", "-")
+    repo_url = f"{DOCKER.host}/repositories/{DOCKER.org}/{repo}/tags"
+
+    token = await get_hub_jwt()
+    res = await HUB_CLIENT.get(repo_url, headers={"Authorization": f"JWT {token}"})
+    if res.status_code == 401:
+        token = await get_hub_jwt(stale=token)
+        res = await HUB_CLIENT.get(repo_url, headers={"Authorization": f"JWT {token}"})
     data = res.json()
 
     return [el["name"] for el in data["results"]]
 
 
+@lru_cache(maxsize=1)
+def get_docker_client():
+    """
+    docker client shared by all builds, logged in once
+    """
+    client = docker.from_env()
+    client.login(username=DOCKER.user, password=DOCKER.token)
+
+    return client
 
 
 def mlflow_build_docker(source, name, env):
-    org = config.get('Docker', 'ORG')
-    print(f'mlflow models build-docker -m {source} -n {org}/{name} --env-manager {env}')
-    os.system(
-        f'mlflow models build-docker -m {source} -n {org}/{name} --env-manager {env}'
-    )
+    command = [
+        "mlflow", "models", "build-docker",
+        "-m", source, "-n", f"{DOCKER.org}/{name}", "--env-manager", env,
+    ]
+    print(" ".join(command))
+    subprocess.run(command, check=True)
 
 
-def docker_push(name):
-    base_url = config.get('Docker', 'HOST')
-    token = config.get('Docker', 'TOKEN')
-    user = config.get('Docker', 'USER')
-    org = config.get('Docker', 'ORG')
+def base_image_exists(tag):
+    """
+    ask the registry for the base image manifest instead of listing all tags
+    """
+    try:
+        get_docker_client().api.inspect_distribution(f"{DOCKER.org}/{BASE_IMAGE_NAME}:{tag}")
+    except docker.errors.APIError:
+        return False
 
-    client = docker.from_env()
-    client.login(username = user, password=token)
+    return True
 
-    return client.api.push(f"{org}/{name}")
 
+def last_progress_event(events):
+    """
+    consume a docker progress stream and keep only the final event
+    """
+    last = None
+    for event in events:
+        if "error" in event:
+            raise Exception(event["error"])
+        last = event
 
-def docker_pull(name):
-    base_url = config.get('Docker', 'HOST')
-    token = config.get('Docker', 'TOKEN')
-    user = config.get('Docker', 'USER')
-    org = config.get('Docker', 'ORG')
+    return last
 
-    client = docker.from_env()
-    client.login(username = user, password=token)
 
-    return client.api.pull(f"{org}/{name}")
+def docker_push(name):
+    return last_progress_event(
+        get_docker_client().api.push(f"{DOCKER.org}/{name}", stream=True, decode=True))
+
 
+def docker_pull(name):
+    return last_progress_event(
+        get_docker_client().api.pull(f"{DOCKER.org}/{name}", stream=True, decode=True))
 
 
-def build_mlflow_packer_base(python_version, tag, req_file_name, modeldir):
+
+def has_code_packages(model_dir):
     """
-    create a base image for to serve a model with all the required dependencies
+    check if the model code folder contains libs that setup.py installs
     """
+    return any(
+        os.path.isfile(os.path.join(folder, f))
+        for folder in glob.glob(os.path.join(model_dir, "code", "*"))
+        for f in PACKAGE_FILES
+    )
 
-    org = config.get('Docker', 'ORG')
 
-    dockerfile = f"""
-FROM python:{python_version}
+def file_md5(path, salt=b""):
+    """
+    salted md5 hex digest of a file
+    """
+    with open(path, "rb") as f:
+        if hasattr(hashlib, "file_digest"):
+            return hashlib.file_digest(f, lambda: hashlib.md5(salt)).hexdigest()
 
-COPY {modeldir.name}/requirements.txt /tmp/
-RUN pip install -r /tmp/requirements.txt \\
-    && pip install uvicorn==0.18.2 protobuf==3.20.* fastapi==0.80.*\\
-    && mkdir -p /model
+        # python < 3.11, read in chunks of 1M
+        md5_hash = hashlib.md5(salt)
+        for byte_block in iter(lambda: f.read(1 << 20), b""):
+            md5_hash.update(byte_block)
+        return md5_hash.hexdigest()
 
-WORKDIR /model
-EXPOSE 8080
 
-ENTRYPOINT gunicorn main:app --workers 2 --worker-class uvicorn.workers.UvicornWorker --bind 0.0.0.0:8080 --timeout 120
-    
+def prune_docker_if_needed():
+    """
+    prune unused docker data if the disk runs full, pruning also drops the
+    layer cache of the next builds
+    """
+    usage = shutil.disk_usage(PRUNE_PATH)
+    if usage.free / usage.total < PRUNE_FREE_RATIO:
+        print(f"prune docker, {usage.free} of {usage.total} bytes free")
+        subprocess.run(["docker", "system", "prune", "-f"])
 
-"""
-    
-    with open("baseDockerfile", 'w') as f:
-        f.write(dockerfile)
-    os.system(
-        f'docker build -f baseDockerfile -t {org}/{BASE_IMAGE_NAME}:{tag} .' 
+
+def prepare_buildx():
+    """
+    login the docker cli and create the buildx builder, registry cache
+    export is not supported by the default docker driver
+    """
+    subprocess.run(
+        ["docker", "login", "-u", DOCKER.user, "--password-stdin"],
+        input=DOCKER.token.encode(), check=True,
     )
+    builder = subprocess.run(
+        ["docker", "buildx", "inspect", BUILDX_BUILDER], capture_output=True
+    )
+    if builder.returncode != 0:
+        subprocess.run(
+            ["docker", "buildx", "create", "--name", BUILDX_BUILDER, "--driver", "docker-container"]
+        )
+
+
+def build_mlflow_packer_base(python_version, tag, req_file_name, modeldir):
+    """
+    create a base image for to serve a model with all the required dependencies
+    """
 
+    dockerfile = BASE_DOCKERFILE.substitute(
+        python_version=python_version, model_dir=modeldir.name)
+
+    # the build context is the download dir containing the model dir
+    build_ctx = os.path.dirname(modeldir.path)
+
+    # build with the registry layer cache and push directly from buildx
+    prepare_buildx()
+    image = f"{DOCKER.org}/{BASE_IMAGE_NAME}:{tag}"
+    # one cache per python version, they share no layers
+    cache = f"{DOCKER.org}/{BASE_IMAGE_NAME}:{BASE_IMAGE_CACHE_TAG}-{python_version}"
+    subprocess.run(
+        [
+            "docker", "buildx", "build", "--builder", BUILDX_BUILDER,
+            "--cache-from", f"type=registry,ref={cache}",
+            "--cache-to", f"type=registry,ref={cache},mode=max",
+            "-f", "-", "-t", image, "--push", ".",
+        ],
+        input=dockerfile.encode(), cwd=build_ctx, check=True,
+    )
 
-    return docker_push(f'{BASE_IMAGE_NAME}:{tag}')
+    return image
         
             
         
@@ -132,17 +374,11 @@ def build_with_base_image(model, version):
     """
     
     import tempfile
-    import yaml
-    import hashlib
-
-    org = config.get('Docker', 'ORG')
-    cwd = os.getcwd()
 
     with tempfile.TemporaryDirectory() as tmpdirname:
-        os.chdir(tmpdirname)
-        command = f'mlflow artifacts  download -u {version.source} -d {tmpdirname}'
-        print(command)
-        os.system(command)
+        # download in process with the environment set up by the mlflow client
+        print(f"download artifacts {version.source}")
+        download_artifacts(artifact_uri=version.source, dst_path=tmpdirname)
 
         model_dir = list(os.scandir(tmpdirname))
         if len(model_dir) == 1:
@@ -153,36 +389,27 @@ def build_with_base_image(model, version):
         # extract python version
         with open(os.path.join(model_dir, "conda.yaml"), "r") as stream:
             try:
-                python_version = [
-                    d for d in yaml.safe_load(stream)["dependencies"]
-                    if "python" in d
-                    ][0]
-                python_version = python_version.split("=")[-1]
+                conda_env = yaml.load(stream, Loader=YAML_LOADER)
             except yaml.YAMLError as exc:
                 raise Exception("Problem parsing conda.yaml")
 
+        python_version = next(
+            (d for d in conda_env["dependencies"] if isinstance(d, str) and d.startswith("python=")),
+            None)
+        if python_version is None:
+            raise Exception("No python version in conda.yaml")
+        python_version = python_version.split("=")[-1]
+
         # create requirements hash
-        md5_hash = hashlib.md5()
-        md5_hash.update(b"24.01.2023")
-        req_file_name = os.path.join(model_dir, "requirements.txt") 
-        with open(req_file_name,"rb") as f:
-            # Read and update hash in chunks of 4K
-            for byte_block in iter(lambda: f.read(4096),b""):
-                md5_hash.update(byte_block)
-        req_hash = md5_hash.hexdigest()
-
-        # check if the matching minimal model container is available
-        try:
-            known_containers = get_repo_tags(BASE_IMAGE_NAME)
-        except:
-            known_containers = []
+        req_file_name = os.path.join(model_dir, "requirements.txt")
+        req_hash = file_md5(req_file_name, BASE_IMAGE_SALT)
 
         new_tag = f"{python_version}-{req_hash}"
-        
-        # compute a new container if needed
-        if new_tag not in known_containers:
+
+        # compute a new container if the matching minimal model container is not available
+        if not base_image_exists(new_tag):
             res = build_mlflow_packer_base(python_version, new_tag, req_file_name, model_dir)
-        else:
+        elif not get_docker_client().images.list(name=f"{DOCKER.org}/{BASE_IMAGE_NAME}:{new_tag}"):
             print(f"pull image {BASE_IMAGE_NAME}:{new_tag}")
             docker_pull(f"{BASE_IMAGE_NAME}:{new_tag}")
 
@@ -191,30 +418,22 @@ def build_with_base_image(model, version):
         shutil.copyfile("/app/buildtemplate/setup.py", os.path.join(model_dir, "setup.py"))
 
         # create dockerfile with the serving
-        dockerfile = f"""
-        
-FROM {org}/{BASE_IMAGE_NAME}:{new_tag}
-
-COPY {model_dir.name}/ /model/
-RUN python setup.py
-
-        """
-        
-        with open("Dockerfile", 'w') as f:
-            f.write(dockerfile)
+        template = MODEL_WHEELS_DOCKERFILE if has_code_packages(model_dir) else MODEL_DOCKERFILE
+        dockerfile = template.substitute(
+            python_version=python_version,
+            base_image=f"{DOCKER.org}/{BASE_IMAGE_NAME}:{new_tag}",
+            model_dir=model_dir.name)
 
         # build the dockerfile
         new_name = f"{model.name.lower().replace('_', '-')}:{version.version}"
-        os.system(
-            f'docker build -f Dockerfile -t {org}/{new_name} .' 
-        )        
+        subprocess.run(
+            ["docker", "build", "-f", "-", "-t", f"{DOCKER.org}/{new_name}", "."],
+            input=dockerfile.encode(), cwd=tmpdirname, env={**os.environ, "DOCKER_BUILDKIT": "1"}, check=True,
+        )
 
         # publish the container
         res = docker_push(new_name)
 
-
-
-    os.chdir(cwd)
     return res
 
 
@@ -227,6 +446,23 @@ app = FastAPI(
 )
 
 
+@app.on_event("startup")
+async def startup():
+    get_mflow_client()
+
+    # login once, a failure here is retried by the first build
+    try:
+        await asyncio.to_thread(get_docker_client)
+    except docker.errors.DockerException as exc:
+        print(f"Docker login failed: {exc}")
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await HUB_CLIENT.aclose()
+    BUILD_EXECUTOR.shutdown(wait=False)
+
+
 @app.get("/", include_in_schema=False)
 async def root():
     return RedirectResponse(url='/docs')
@@ -239,7 +475,7 @@ class MlflowList(BaseModel):
 
 
 @app.get("/models",  response_model=List[MlflowList])
-async def list_models():
+def list_models():
     """
     List the available model versions in mlflow registry:
 
@@ -248,13 +484,8 @@ async def list_models():
     """
 
 
-    # extract list of marked tags
-    model_tags = [e.strip() for e in config.get("Models", "TAGS", fallback = "").split(",") if e != '']
-
-    # use the mlflow client to get all models
-    mlflow_c = get_mflow_client()
-    models = [m for m in mlflow_c.list_registered_models() if any(
-        [t  in m.tags.keys() for t in model_tags]) or len(model_tags) == 0]
+    # use the mlflow client to get all marked models
+    models = list_marked_models()
 
     return JSONResponse([
         {
@@ -284,44 +515,114 @@ async def list_docker_models():
     """
 
 
-    # extract list of marked tags
-    model_tags = [e.strip() for e in config.get("Models", "TAGS", fallback = "").split(",") if e != '']
+    # use the mlflow client to get all marked models
+    models = await asyncio.to_thread(list_marked_models)
 
-    # use the mlflow client to get all models
-    mlflow_c = get_mflow_client()
-    models = [m for m in mlflow_c.list_registered_models() if any(
-        [t  in m.tags.keys() for t in model_tags]) or len(model_tags) == 0]
+    # one jwt for all tag requests, fetched before the fan out
+    await get_hub_jwt()
+    semaphore = asyncio.Semaphore(HUB_CONCURRENCY)
+
+    async def repo_tags(name):
+        async with semaphore:
+            return await get_repo_tags(name)
+
+    tags = await asyncio.gather(*(repo_tags(m.name) for m in models))
 
     return JSONResponse([
         {
             "name": m.name,
-            "versions":  get_repo_tags(m.name)
-            } for m in models])
+            "versions": versions
+            } for m, versions in zip(models, tags)])
+
+
+
+
 
 
+def run_build(task_id, model, version, env):
+    """
+    build the model image and push it, runs in the build executor
+    """
+    _build_jobs[task_id]["status"] = "running"
+
+    # cleanup before start
+    prune_docker_if_needed()
+
+    if env == "baseimage":
+        res = build_with_base_image(model, version)
+    else:
+        new_name = f"{model.name.lower().replace('_', '-')}:{version.version}"
+
+        mlflow_build_docker(version.source, new_name, env)
+        res = docker_push(new_name)
+
+    clear_registry_cache()
+
+    return res
 
 
+async def run_build_job(task_id, key, model, version, env):
+    job = _build_jobs[task_id]
+
+    try:
+        job["result"] = await asyncio.get_running_loop().run_in_executor(
+            BUILD_EXECUTOR, run_build, task_id, model, version, env)
+        job["status"] = "done"
+    except Exception as exc:
+        print(f"Build {task_id} failed: {exc}")
+        job["result"] = str(exc)
+        job["status"] = "failed"
+    finally:
+        _inflight_builds.pop(key, None)
+        job.pop("task", None)
+        job["expires"] = time.monotonic() + BUILD_JOB_TTL
+
+
+def expire_build_jobs():
+    """
+    forget finished jobs after BUILD_JOB_TTL
+    """
+    now = time.monotonic()
+    for task_id in [k for k, job in _build_jobs.items() if job.get("expires", now) < now]:
+        del _build_jobs[task_id]
 
 
 class BuildResponse(BaseModel):
     result: str
 
-@app.get("/build", response_model=BuildResponse)
+
+class BuildTask(BaseModel):
+    task_id: str
+
+
+class BuildStatus(BaseModel):
+    task_id: str
+    status: str
+    result: Any = None
+
+
+@app.get(
+    "/build", response_model=BuildTask, status_code=202,
+    responses={200: {"model": BuildResponse}},
+)
 async def build_docker_model(name: str, version: str, env: str = "baseimage"):
     """
-    Build a new model version an push it to the server regitry
+    Start to build a new model version an push it to the server regitry,
+    the build runs in the background and is polled with /build/{task_id}
 
     - **name**: model name
     - **version**: the version to build
     - **env**: specify environment manager (local, conda, virtualenv, baseimage)
     """
 
-    # cleanup before start
-    os.system("docker system prune -f")
+    # join an identical build that is still running
+    key = (name, version, env)
+    if key in _inflight_builds:
+        return JSONResponse({"task_id": _inflight_builds[key]}, status_code=202)
 
     # use the mlflow client to get all models
     mlflow_c = get_mflow_client()
-    models = mlflow_c.list_registered_models()
+    models = await asyncio.to_thread(mlflow_c.list_registered_models)
 
     model = [m for m in models if m.name == name]
 
@@ -338,17 +639,33 @@ async def build_docker_model(name: str, version: str, env: str = "baseimage"):
 
     version = version[0]
 
-    if env == "baseimage":
+    # an identical build may have started during the registry lookup
+    if key in _inflight_builds:
+        return JSONResponse({"task_id": _inflight_builds[key]}, status_code=202)
 
-        res = build_with_base_image(model, version)
-        return JSONResponse({"result": res})
+    expire_build_jobs()
 
-    else:
+    task_id = uuid.uuid4().hex
+    _build_jobs[task_id] = {"status": "pending", "result": None}
+    _inflight_builds[key] = task_id
+    # keep a reference, the event loop only holds tasks weakly
+    _build_jobs[task_id]["task"] = asyncio.create_task(
+        run_build_job(task_id, key, model, version, env))
 
-        new_name = f"{model.name.lower().replace('_', '-')}:{version.version}"
-        
-        mlflow_build_docker(version.source, new_name, env)
-        res = docker_push(new_name)
+    return JSONResponse({"task_id": task_id}, status_code=202)
+
+
+@app.get("/build/{task_id}", response_model=BuildStatus)
+async def build_status(task_id: str):
+    """
+    Status of a build started with /build, finished builds are kept for an hour
+
+    - **status**: pending, running, done or failed
+    - **result**: push result of a done build or the error of a failed one
+    """
 
-        return JSONResponse({"result": res})
+    job = _build_jobs.get(task_id)
+    if job is None:
+        return JSONResponse({"result": "Task not found."}, status_code=404)
 
+    return JSONResponse({"task_id": task_id, "status": job["status"], "result": job["result"]})